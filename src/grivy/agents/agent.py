@@ -1,15 +1,22 @@
-from typing import List
+from typing import TYPE_CHECKING, List
 
-from langchain.agents import create_agent
-from langchain_core.language_models import BaseChatModel
-from langgraph.checkpoint.memory import MemorySaver
+if TYPE_CHECKING:
+    from langchain_core.language_models import BaseChatModel
 
+# 仅在一轮对话结束时写入检查点：CLI 不需要中途恢复，省去每个 super-step 的状态序列化。
+# 调用方在 stream/astream_events 时通过 durability 参数传入。
+CHECKPOINT_DURABILITY = "exit"
 
-def build_agent(llm: BaseChatModel, tools: List):
+
+def build_agent(llm: "BaseChatModel", tools: List):
     """
     创建符合 LangChain 最佳实践的 Agent，使用 LangGraph 内置的持久化和流式支持。
     仅调用已加载的本地 Trivy 工具，缺参需追问，避免输出过长。
     """
+    # langchain.agents 导入开销较大，CLI 启动时延迟到真正构建 Agent 时再导入
+    from langchain.agents import create_agent
+    from langgraph.checkpoint.memory import MemorySaver
+
     system_prompt = (
         "你是安全漏洞扫描助手，只能调用已加载的 Trivy 本地工具。"
         " 当用户仅咨询能力时调用 trivy_help；缺少必需参数要先追问。"
@@ -17,7 +24,7 @@ def build_agent(llm: BaseChatModel, tools: List):
         " 扫描结果会自动保存到 data/ 目录下。"
     )
 
-    # 创建内存保存器用于对话历史持久化
+    # 创建内存保存器用于对话历史持久化，写入时机由 CHECKPOINT_DURABILITY 控制
     checkpointer = MemorySaver()
 
     # 使用 LangChain 1.0 的 create_agent API，直接传入 checkpointer
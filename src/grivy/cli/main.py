@@ -1,25 +1,111 @@
 import argparse
+import asyncio
 import sys
-from typing import cast
+import time
+from typing import TYPE_CHECKING, List, cast
 
 from dotenv import load_dotenv
-from langchain_core.runnables import RunnableConfig
-from langchain_openai import ChatOpenAI
 from prompt_toolkit import PromptSession
 from prompt_toolkit.formatted_text import ANSI
 from prompt_toolkit.history import InMemoryHistory
-from prompt_toolkit.patch_stdout import patch_stdout
 
-from grivy.agents.agent import build_agent
-from grivy.tools.trivy_tools import get_tools
+from grivy.agents.agent import CHECKPOINT_DURABILITY, build_agent
 from grivy.cli.style import color_text
 
+if TYPE_CHECKING:
+    from langchain_core.runnables import RunnableConfig
+
+# 欢迎信息与对话标签只需生成一次，启动时一次性写出
+_WELCOME = "\n".join(
+    [
+        "欢迎使用 Trivy Agent，对话输入需求，输入 'exit' 退出。",
+        "支持的命令：",
+        "  - 扫描镜像：'扫描 nginx:latest 镜像的漏洞'",
+        "  - 扫描目录：'扫描 ./src 目录'",
+        "  - 扫描仓库：'扫描 https://github.com/example/repo'",
+        "  - 扫描 SBOM：'扫描 sbom.json 文件'",
+        "  - 获取帮助：'你能做什么？' 或 '帮助'\n",
+    ]
+)
+_USER_LABEL = color_text("你", "peach")
+_AGENT_LABEL = color_text("Agent", "lavender")
+
+
+class _TokenFlusher:
+    """
+    攒批输出流式 token：满 8 个或距上次刷新超过 50ms 才写出，减少逐 token flush。
+    模型停顿时由 run() 启动的定时任务兜底刷新，缓冲不会滞留超过 interval。
+    """
+
+    def __init__(self, max_chunks: int = 8, interval: float = 0.05) -> None:
+        self._buf: List[str] = []
+        self._max_chunks = max_chunks
+        self._interval = interval
+        self._last_flush = time.monotonic()
+
+    def write(self, text: str) -> None:
+        self._buf.append(text)
+        if (
+            len(self._buf) >= self._max_chunks
+            or time.monotonic() - self._last_flush > self._interval
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        if self._buf:
+            sys.stdout.write("".join(self._buf))
+            self._buf.clear()
+        sys.stdout.flush()
+        self._last_flush = time.monotonic()
+
+    async def run(self) -> None:
+        """按 interval 定期刷新，需在流式输出期间作为 asyncio 任务运行。"""
+        while True:
+            await asyncio.sleep(self._interval)
+            if self._buf and time.monotonic() - self._last_flush >= self._interval:
+                self.flush()
+
 
 def build_llm(model: str, temperature: float = 0):
     """构建 LLM；默认开启流式输出。"""
+    from langchain_openai import ChatOpenAI
+
     return ChatOpenAI(model=model, temperature=temperature, streaming=True)
 
 
+async def run_stream(agent, config: "RunnableConfig", user_input: str):
+    """把一轮用户输入交给 Agent，并流式打印模型输出。"""
+    input_data = {"messages": [{"role": "user", "content": user_input}]}
+    out = _TokenFlusher()
+    ticker = asyncio.create_task(out.run())
+    try:
+        async for event in agent.astream_events(
+            input_data,
+            config,
+            version="v1",
+            durability=CHECKPOINT_DURABILITY,
+        ):
+            if event["event"] == "on_chat_model_stream":
+                chunk = event["data"].get("chunk")
+                if chunk:
+                    text = getattr(chunk, "text", None)
+                    if not text:
+                        content = getattr(chunk, "content", None)
+                        text = content if isinstance(content, str) else ""
+                    if text:
+                        out.write(text)
+            elif event["event"] == "on_tool_start":
+                # 工具执行期间会打印 trivy 日志，先输出已缓冲的文本
+                out.flush()
+        out.flush()
+        print()
+    except Exception as e:
+        out.flush()
+        print(f"\n流式输出出错: {e}")
+    finally:
+        ticker.cancel()
+
+
 def main():
     parser = argparse.ArgumentParser(description="Trivy + LangChain CLI Agent")
     parser.add_argument(
@@ -31,10 +117,6 @@ def main():
 
     load_dotenv()
 
-    tools = get_tools()
-    llm = build_llm(args.model)
-    agent = build_agent(llm, tools)
-
     # CLI intput prompt session，not related with LangChain session
     session = PromptSession(
         history=InMemoryHistory(),
@@ -42,67 +124,46 @@ def main():
         prompt_continuation=lambda *_: "",
     )
 
-    config = cast(RunnableConfig, {"configurable": {"thread_id": "local-cli"}})
+    config = cast("RunnableConfig", {"configurable": {"thread_id": "local-cli"}})
+
+    print(_WELCOME)
 
-    print("欢迎使用 Trivy Agent，对话输入需求，输入 'exit' 退出。")
-    print("支持的命令：")
-    print("  - 扫描镜像：'扫描 nginx:latest 镜像的漏洞'")
-    print("  - 扫描目录：'扫描 ./src 目录'")
-    print("  - 扫描仓库：'扫描 https://github.com/example/repo'")
-    print("  - 扫描 SBOM：'扫描 sbom.json 文件'")
-    print("  - 获取帮助：'你能做什么？' 或 '帮助'\n")
+    # LangChain / OpenAI 相关模块导入较重，推迟到欢迎信息输出之后，缩短首屏等待
+    from grivy.tools.trivy_tools import get_tools
 
-    user_label = color_text("你", "peach")
-    agent_label = color_text("Agent", "lavender")
+    tools = get_tools()
+    llm = build_llm(args.model)
+    agent = build_agent(llm, tools)
 
-    while True:
-        try:
-            # 使用 prompt_toolkit 提供的增强输入，兼容多种终端的光标/删除键行为
-            with patch_stdout():
+    # 整个会话复用同一个事件循环，避免每轮重建 loop，LLM 客户端的 HTTP 连接也能保持复用
+    with asyncio.Runner() as runner:
+        while True:
+            try:
+                # 使用 prompt_toolkit 提供的增强输入，兼容多种终端的光标/删除键行为
+                # 输入期间没有后台输出，无需 patch_stdout；Agent 流式输出在 prompt 返回后才开始
                 # 使用 ANSI 封装，确保 prompt_toolkit 正确解析颜色转义序列
-                user_input = session.prompt(ANSI(f"\n{user_label}: ")).strip()
-            if user_input.lower() in {"exit", "quit", "q"}:
-                print("\n再见！")
-                break
-            if not user_input:
+                user_input = runner.run(
+                    session.prompt_async(ANSI(f"\n{_USER_LABEL}: "))
+                ).strip()
+                if user_input.lower() in {"exit", "quit", "q"}:
+                    print("\n再见！")
+                    break
+                if not user_input:
+                    continue
+
+                # 直接进入 Agent 输出，不重复回显用户输入
+                print(f"\n{_AGENT_LABEL}: ", end="", flush=True)
+
+                runner.run(run_stream(agent, config, user_input))
+
+            except KeyboardInterrupt:
+                print("\n\n再见！")
+                sys.exit(0)
+            except Exception as e:
+                print(f"\n\n错误: {e}")
+                print("请检查网络连接和 API 密钥配置。")
                 continue
 
-            # 直接进入 Agent 输出，不重复回显用户输入
-            print(f"\n{agent_label}: ", end="", flush=True)
-
-            import asyncio
-
-            async def run_stream():
-                input_data = {"messages": [{"role": "user", "content": user_input}]}
-                try:
-                    async for event in agent.astream_events(
-                        input_data,
-                        config,
-                        version="v1",
-                    ):
-                        if event["event"] == "on_chat_model_stream":
-                            chunk = event["data"].get("chunk")
-                            if chunk:
-                                text = getattr(chunk, "text", None)
-                                if not text:
-                                    content = getattr(chunk, "content", None)
-                                    text = content if isinstance(content, str) else ""
-                                if text:
-                                    print(text, end="", flush=True)
-                    print()
-                except Exception as e:
-                    print(f"\n流式输出出错: {e}")
-
-            asyncio.run(run_stream())
-
-        except KeyboardInterrupt:
-            print("\n\n再见！")
-            sys.exit(0)
-        except Exception as e:
-            print(f"\n\n错误: {e}")
-            print("请检查网络连接和 API 密钥配置。")
-            continue
-
 
 if __name__ == "__main__":
     main()
@@ -1,75 +1,106 @@
-import json
+import heapq
+from collections import Counter
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+import ijson
+import orjson
 
 # 解析 Trivy JSON 报告并生成精简摘要，避免把大 JSON 直接交给 LLM。
 
 SEVERITY_ORDER = ["CRITICAL", "HIGH", "MEDIUM", "LOW", "UNKNOWN"]
+_SEVERITY_RANK: Dict[str, int] = {s: i for i, s in enumerate(SEVERITY_ORDER)}
+
+# Results 条目中的发现来源：(字段名, ID 字段, 包/目标字段, 类型)
+_FINDING_SOURCES = (
+    ("Vulnerabilities", "VulnerabilityID", "PkgName", "vuln"),
+    ("Misconfigurations", "ID", "Target", "misconfig"),
+)
+
+# 超过该大小的报告走 ijson 流式解析，较小的报告整体加载反而更快
+STREAM_THRESHOLD_BYTES = 10 * 1024 * 1024
 
 
 def load_report(report_path: Path) -> Dict[str, Any]:
-    with report_path.open("r", encoding="utf-8") as f:
-        return json.load(f)
+    return orjson.loads(report_path.read_bytes())
 
 
-def _collect_items(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """提取漏洞和配置问题，统一字段，便于排序。"""
-    items: List[Dict[str, Any]] = []
-    for entry in results:
-        for vuln in entry.get("Vulnerabilities", []) or []:
-            items.append(
-                {
-                    "id": vuln.get("VulnerabilityID"),
-                    "title": vuln.get("Title") or vuln.get("Description"),
-                    "severity": vuln.get("Severity"),
-                    "pkg": vuln.get("PkgName"),
-                    "type": "vuln",
-                }
-            )
-        for mis in entry.get("Misconfigurations", []) or []:
-            items.append(
-                {
-                    "id": mis.get("ID"),
-                    "title": mis.get("Title") or mis.get("Description"),
-                    "severity": mis.get("Severity"),
-                    "pkg": mis.get("Target"),
-                    "type": "misconfig",
-                }
-            )
-    return items
-
-
-def _severity_rank(sev: str) -> int:
-    try:
-        return SEVERITY_ORDER.index(sev.upper())
-    except Exception:
-        return len(SEVERITY_ORDER)
+def _iter_results(report_path: Path) -> Iterator[Dict[str, Any]]:
+    """逐个产出 Results 条目；大报告用 ijson 流式解析，避免整份报告驻留内存。"""
+    if report_path.stat().st_size <= STREAM_THRESHOLD_BYTES:
+        yield from load_report(report_path).get("Results") or []
+        return
+    with report_path.open("rb") as f:
+        yield from ijson.items(f, "Results.item")
 
 
-def summarize_report(report_path: Path, top_k: int = 5) -> Dict[str, Any]:
-    """返回摘要信息：高危计数、Top K 风险条目、总数."""
-    data = load_report(report_path)
-    results = data.get("Results") or []
-    items = _collect_items(results)
+def _normalize_severity(sev: Any) -> Any:
+    return sev.upper() if isinstance(sev, str) else sev
 
-    high = sum(1 for i in items if (i.get("severity") or "").upper() == "HIGH")
-    critical = sum(1 for i in items if (i.get("severity") or "").upper() == "CRITICAL")
 
+def _collect_items(
+    results: Iterable[Dict[str, Any]], top_k: int
+) -> Tuple[List[Dict[str, Any]], Counter]:
+    """
+    单次遍历提取漏洞和配置问题：按严重度（统一转为大写）计数，
+    并用大小为 top_k 的堆保留最严重的条目；统一字段的字典只为最终的 Top K 构造。
+    """
+    counts: Counter = Counter()
+    # 堆元素为 (-rank, -seq, severity, raw, source) 的紧凑元组，
+    # 堆顶是当前 Top K 中最不严重、最晚出现的条目
+    heap: List[Tuple[int, int, Any, Dict[str, Any], Tuple[str, ...]]] = []
+    seq = 0
+    for entry in results:
+        for source in _FINDING_SOURCES:
+            for raw in entry.get(source[0], []) or []:
+                sev = _normalize_severity(raw.get("Severity"))
+                counts[sev] += 1
+                if top_k <= 0:
+                    continue
+                rank = _severity_rank(sev)
+                if len(heap) == top_k and rank >= -heap[0][0]:
+                    continue
+                seq += 1
+                if len(heap) < top_k:
+                    heapq.heappush(heap, (-rank, -seq, sev, raw, source))
+                else:
+                    heapq.heapreplace(heap, (-rank, -seq, sev, raw, source))
     # 按严重度排序，严重度相同保持原顺序
-    sorted_items = sorted(items, key=lambda x: _severity_rank(x.get("severity") or "ZZZ"))
-    top_items = sorted_items[:top_k]
-
-    top_brief = [
+    top = [
         {
-            "id": i.get("id"),
-            "title": i.get("title"),
-            "severity": i.get("severity"),
-            "pkg": i.get("pkg"),
-            "type": i.get("type"),
+            "id": raw.get(id_field),
+            "title": raw.get("Title") or raw.get("Description"),
+            "severity": sev,
+            "pkg": raw.get(pkg_field),
+            "type": kind,
         }
-        for i in top_items
+        for _, _, sev, raw, (_, id_field, pkg_field, kind) in sorted(heap, reverse=True)
     ]
+    return top, counts
+
+
+def _severity_rank(sev: Any) -> int:
+    # 严重度已在 _collect_items 中统一为大写，这里只需查表
+    return _SEVERITY_RANK.get(sev, len(SEVERITY_ORDER))
+
+
+def summarize_report(report_path: Path, top_k: int = 5) -> Dict[str, Any]:
+    """返回摘要信息：高危计数、Top K 风险条目、总数."""
+    top_brief, counts = _collect_items(_iter_results(report_path), top_k)
+    total = sum(counts.values())
+
+    # 干净镜像等无发现的情况最常见，直接返回固定摘要
+    if not total:
+        return {
+            "summary_text": "扫描完成，无风险条目。",
+            "high": 0,
+            "critical": 0,
+            "top": [],
+            "total_findings": 0,
+        }
 
+    high = counts["HIGH"]
+    critical = counts["CRITICAL"]
     summary_text = (
         f"扫描完成。High: {high}, Critical: {critical}。"
         f" Top {len(top_brief)} 风险示例: "
@@ -85,5 +116,5 @@ def summarize_report(report_path: Path, top_k: int = 5) -> Dict[str, Any]:
         "high": high,
         "critical": critical,
         "top": top_brief,
-        "total_findings": len(items),
+        "total_findings": total,
     }
@@ -18,13 +18,14 @@ _PALETTE: Dict[str, Tuple[int, int, int]] = {
 
 RESET = "\033[0m"
 
+# 预先生成各颜色的转义前缀，渲染时只需查表
+_CODES: Dict[str, str] = {
+    name: f"\033[38;2;{r};{g};{b}m" for name, (r, g, b) in _PALETTE.items()
+}
+
 
 def _rgb_code(name: str) -> str:
-    rgb = _PALETTE.get(name)
-    if not rgb:
-        return ""
-    r, g, b = rgb
-    return f"\033[38;2;{r};{g};{b}m"
+    return _CODES.get(name, "")
 
 
 def color_text(text: str, color: str) -> str:
@@ -1,10 +1,19 @@
+import asyncio
+import functools
+import inspect
+import os
+import re
+import selectors
 import subprocess
+import sys
 import time
+import uuid
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Callable, Dict, List, Literal, Optional, Tuple
 
 from langchain.tools import tool
-from pydantic import BaseModel, Field, validator
+from langchain_core.tools import StructuredTool
+from pydantic import BaseModel, Field
 
 from grivy.cli.output_handler import summarize_report
 from grivy.cli.style import dim_text
@@ -16,6 +25,12 @@ DATA_DIR = Path("data")
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 DEFAULT_TIMEOUT = 300  # 秒
+ReportFormat = Literal["json", "table", "sarif"]
+_READ_CHUNK_SIZE = 1 << 16
+_ECHO_BATCH_LINES = 64
+_ECHO_FLUSH_INTERVAL = 0.1  # 秒
+# trivy 调试级日志（可带时间戳前缀），回显时直接跳过
+_SKIP_LOG_RE = re.compile(rb"^(?:\S+\s+)?(?:DEBUG|TRACE)\b")
 
 
 class _BaseScanInput(BaseModel):
@@ -27,7 +42,7 @@ class _BaseScanInput(BaseModel):
         default=True,
         description="是否忽略尚未有修复的漏洞 (--ignore-unfixed)",
     )
-    format: str = Field(
+    format: ReportFormat = Field(
         default="json",
         description="输出格式：json | table | sarif，内部默认 json 便于解析",
     )
@@ -42,13 +57,6 @@ class _BaseScanInput(BaseModel):
         description="自定义报告输出路径，默认存储在 data/ 目录",
     )
 
-    @validator("format")
-    def validate_format(cls, v: str) -> str:
-        allowed = {"json", "table", "sarif"}
-        if v not in allowed:
-            raise ValueError(f"format 必须是 {allowed}")
-        return v
-
 
 class ImageScanInput(_BaseScanInput):
     image: str = Field(..., description="镜像名，例如 alpine:3.19")
@@ -68,6 +76,30 @@ class SbomScanInput(_BaseScanInput):
     sbom_path: str = Field(..., description="本地 SBOM 文件路径")
 
 
+def _build_argv(
+    subcmd: str,
+    target: str,
+    severity: str,
+    format: str,
+    report_path: Path,
+    ignore_unfixed: bool,
+    target_flag: Optional[str] = None,
+) -> list:
+    """
+    拼装各扫描子命令共用的 trivy 参数。
+    target_flag 为空时目标作为末尾位置参数，否则以 `<target_flag> <target>` 紧跟子命令。
+    """
+    cmd = ["trivy", subcmd]
+    if target_flag:
+        cmd += [target_flag, target]
+    cmd += ["--severity", severity, "--format", format, "--output", str(report_path)]
+    if ignore_unfixed:
+        cmd.append("--ignore-unfixed")
+    if not target_flag:
+        cmd.append(target)
+    return cmd
+
+
 def _timestamp() -> str:
     return time.strftime("%Y%m%d-%H%M%S")
 
@@ -75,8 +107,61 @@ def _timestamp() -> str:
 def _build_output_path(prefix: str, user_defined: Optional[str]) -> Path:
     if user_defined:
         return Path(user_defined)
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
-    return DATA_DIR / f"{prefix}-{_timestamp()}.json"
+    # DATA_DIR 已在模块导入时创建，这里不再重复 mkdir；
+    # 加随机后缀，避免同一秒内并发扫描写到同一个报告文件
+    return DATA_DIR / f"{prefix}-{_timestamp()}-{uuid.uuid4().hex[:8]}.json"
+
+
+def _decode_log_line(line: bytes) -> Optional[str]:
+    """按字节判断是否需要回显，只对保留的行做解码；需跳过时返回 None。"""
+    if _SKIP_LOG_RE.match(line):
+        return None
+    return line.decode("utf-8", errors="replace").rstrip()
+
+
+class _LogEcho:
+    """
+    淡色回显 trivy 日志：攒满一批或距上次输出超过刷新间隔才整批写入 stdout，
+    避免逐行 print + flush 带来的大量 ANSI 拼接与系统调用。
+    """
+
+    def __init__(self) -> None:
+        self._lines: List[str] = []
+        self._pending = bytearray()
+        self._last_flush = 0.0  # 首行立即输出，尽快给出反馈
+
+    def feed(self, chunk: bytes) -> None:
+        """写入一段原始输出，按换行切分；末尾不完整的行留待下一段拼接。"""
+        self._pending += chunk
+        lines = self._pending.split(b"\n")
+        self._pending = lines.pop()
+        for line in lines:
+            self.write(line)
+
+    def finish(self) -> None:
+        """输出末尾不带换行的残留内容并刷新。"""
+        if self._pending:
+            self.write(bytes(self._pending))
+            self._pending.clear()
+        self.flush()
+
+    def write(self, line: bytes) -> None:
+        text = _decode_log_line(line)
+        if text is None:
+            return
+        self._lines.append(text)
+        if (
+            len(self._lines) >= _ECHO_BATCH_LINES
+            or time.monotonic() - self._last_flush >= _ECHO_FLUSH_INTERVAL
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        if self._lines:
+            sys.stdout.write(dim_text("\n".join(self._lines)) + "\n")
+            self._lines.clear()
+        sys.stdout.flush()
+        self._last_flush = time.monotonic()
 
 
 def _stream_run(cmd: list, timeout: int) -> int:
@@ -90,28 +175,128 @@ def _stream_run(cmd: list, timeout: int) -> int:
             cmd,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,
+            bufsize=0,
         )
     except FileNotFoundError:
         print(dim_text("[trivy] 未找到 trivy 可执行文件，请确认已安装并在 PATH 中。"))
         return -127
 
-    start = time.time()
+    assert proc.stdout is not None
+    deadline = time.monotonic() + timeout if timeout else None
+
+    def _remaining() -> Optional[float]:
+        if deadline is None:
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        return remaining
+
+    echo = _LogEcho()
     try:
-        for line in proc.stdout or []:
-            print(dim_text(line.rstrip()))
-            if timeout and (time.time() - start) > timeout:
-                proc.kill()
-                raise subprocess.TimeoutExpired(cmd, timeout)
-        proc.wait(timeout=max(1, timeout - int(time.time() - start)))
+        if sys.platform == "win32":
+            _pump_blocking(proc.stdout.fileno(), echo, _remaining)
+        else:
+            _pump_nonblocking(proc.stdout.fileno(), echo, _remaining)
+        echo.finish()
+        proc.wait(timeout=_remaining())
     except subprocess.TimeoutExpired:
+        echo.finish()
         proc.kill()
+        proc.wait()
         print(dim_text(f"[trivy] 扫描超时（>{timeout}s）"))
         return -1
+    finally:
+        proc.stdout.close()
+        # 读取出错或被中断时，确保子进程被结束并回收
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
     return proc.returncode
 
 
+def _pump_nonblocking(
+    fd: int, echo: _LogEcho, remaining: Callable[[], Optional[float]]
+) -> None:
+    """
+    非阻塞读取 + select 等待：超时按墙钟严格生效，不依赖子进程何时输出换行。
+    select 管道仅 POSIX 支持。
+    """
+    os.set_blocking(fd, False)
+    with selectors.DefaultSelector() as selector:
+        selector.register(fd, selectors.EVENT_READ)
+        while True:
+            left = remaining()
+            wait = _ECHO_FLUSH_INTERVAL if left is None else min(_ECHO_FLUSH_INTERVAL, left)
+            if not selector.select(wait):
+                # 子进程暂时无输出，先把已缓冲的日志显示出来
+                echo.flush()
+                continue
+            try:
+                chunk = os.read(fd, _READ_CHUNK_SIZE)
+            except BlockingIOError:
+                continue
+            if not chunk:
+                return
+            echo.feed(chunk)
+
+
+def _pump_blocking(
+    fd: int, echo: _LogEcho, remaining: Callable[[], Optional[float]]
+) -> None:
+    """Windows 不支持 select 管道，退回阻塞读取；超时只在收到输出后检查。"""
+    while chunk := os.read(fd, _READ_CHUNK_SIZE):
+        echo.feed(chunk)
+        remaining()
+
+
+async def _stream_run_async(cmd: list, timeout: int) -> int:
+    """
+    _stream_run 的异步版本：子进程由事件循环托管，多个扫描可以并发执行。
+    返回退出码。
+    """
+    print(dim_text(f"[trivy] 执行命令: {' '.join(cmd)}"))
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+    except FileNotFoundError:
+        print(dim_text("[trivy] 未找到 trivy 可执行文件，请确认已安装并在 PATH 中。"))
+        return -127
+
+    echo = _LogEcho()
+
+    async def _pump() -> int:
+        assert proc.stdout is not None
+        # 按块读取并交给 _LogEcho 切分行，超长且无换行的输出也不会触发 StreamReader 的行长度限制
+        while chunk := await proc.stdout.read(_READ_CHUNK_SIZE):
+            echo.feed(chunk)
+        echo.finish()
+        return await proc.wait()
+
+    async def _tick() -> None:
+        # 子进程暂时无输出时，定期把已缓冲的日志显示出来
+        while True:
+            await asyncio.sleep(_ECHO_FLUSH_INTERVAL)
+            echo.flush()
+
+    ticker = asyncio.create_task(_tick())
+    try:
+        return await asyncio.wait_for(_pump(), timeout or None)
+    except asyncio.TimeoutError:
+        echo.finish()
+        print(dim_text(f"[trivy] 扫描超时（>{timeout}s）"))
+        return -1
+    finally:
+        ticker.cancel()
+        # 超时、读取出错或任务被取消时，确保子进程被结束并回收
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+
+
 def _summarize(report_path: Path) -> Dict:
     if not report_path.exists():
         return {
@@ -129,12 +314,48 @@ def _summarize(report_path: Path) -> Dict:
     }
 
 
-@tool
+def _scan_result(report_path: Path, exit_code: int, target: str) -> Dict:
+    summary = _summarize(report_path)
+    summary["exit_code"] = exit_code
+    summary["target"] = target
+    return summary
+
+
+def _scan_tool(build: Callable[..., Tuple[list, Path, str]]) -> StructuredTool:
+    """
+    把“拼装 trivy 命令”的函数包装成扫描 Tool，同时提供同步与异步实现。
+    build 的签名与文档即 Tool 的参数定义，返回 (cmd, report_path, target)；
+    异步调用时 Agent 并行发起的多个扫描会并发执行。
+    """
+    signature = inspect.signature(build)
+
+    def _timeout(args: tuple, kwargs: dict) -> int:
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return bound.arguments["timeout"]
+
+    @functools.wraps(build)
+    def run(*args, **kwargs) -> Dict:
+        cmd, report_path, target = build(*args, **kwargs)
+        exit_code = _stream_run(cmd, _timeout(args, kwargs))
+        return _scan_result(report_path, exit_code, target)
+
+    @functools.wraps(build)
+    async def arun(*args, **kwargs) -> Dict:
+        cmd, report_path, target = build(*args, **kwargs)
+        exit_code = await _stream_run_async(cmd, _timeout(args, kwargs))
+        # 报告解析是 CPU 密集操作，放到线程池执行，避免阻塞事件循环上其他扫描的日志读取
+        return await asyncio.to_thread(_scan_result, report_path, exit_code, target)
+
+    return StructuredTool.from_function(func=run, coroutine=arun)
+
+
+@_scan_tool
 def trivy_image_scan(
     image: str,
     severity: str = "HIGH,CRITICAL",
     ignore_unfixed: bool = True,
-    format: str = "json",
+    format: ReportFormat = "json",
     timeout: int = DEFAULT_TIMEOUT,
     output_path: Optional[str] = None,
 ):
@@ -150,32 +371,16 @@ def trivy_image_scan(
     """
     target = image
     report_path = _build_output_path("image", output_path)
-    cmd = [
-        "trivy",
-        "image",
-        "--severity",
-        severity,
-        "--format",
-        format,
-        "--output",
-        str(report_path),
-    ]
-    if ignore_unfixed:
-        cmd.append("--ignore-unfixed")
-    cmd.append(target)
-    exit_code = _stream_run(cmd, timeout)
-    summary = _summarize(report_path)
-    summary["exit_code"] = exit_code
-    summary["target"] = target
-    return summary
+    cmd = _build_argv("image", target, severity, format, report_path, ignore_unfixed)
+    return cmd, report_path, target
 
 
-@tool
+@_scan_tool
 def trivy_fs_scan(
     path: str,
     severity: str = "HIGH,CRITICAL",
     ignore_unfixed: bool = True,
-    format: str = "json",
+    format: ReportFormat = "json",
     timeout: int = DEFAULT_TIMEOUT,
     output_path: Optional[str] = None,
 ):
@@ -191,32 +396,16 @@ def trivy_fs_scan(
     """
     target = path
     report_path = _build_output_path("fs", output_path)
-    cmd = [
-        "trivy",
-        "fs",
-        "--severity",
-        severity,
-        "--format",
-        format,
-        "--output",
-        str(report_path),
-    ]
-    if ignore_unfixed:
-        cmd.append("--ignore-unfixed")
-    cmd.append(target)
-    exit_code = _stream_run(cmd, timeout)
-    summary = _summarize(report_path)
-    summary["exit_code"] = exit_code
-    summary["target"] = target
-    return summary
+    cmd = _build_argv("fs", target, severity, format, report_path, ignore_unfixed)
+    return cmd, report_path, target
 
 
-@tool
+@_scan_tool
 def trivy_repo_scan(
     repo_url_or_path: str,
     severity: str = "HIGH,CRITICAL",
     ignore_unfixed: bool = True,
-    format: str = "json",
+    format: ReportFormat = "json",
     timeout: int = DEFAULT_TIMEOUT,
     output_path: Optional[str] = None,
 ):
@@ -232,32 +421,16 @@ def trivy_repo_scan(
     """
     target = repo_url_or_path
     report_path = _build_output_path("repo", output_path)
-    cmd = [
-        "trivy",
-        "repo",
-        "--severity",
-        severity,
-        "--format",
-        format,
-        "--output",
-        str(report_path),
-    ]
-    if ignore_unfixed:
-        cmd.append("--ignore-unfixed")
-    cmd.append(target)
-    exit_code = _stream_run(cmd, timeout)
-    summary = _summarize(report_path)
-    summary["exit_code"] = exit_code
-    summary["target"] = target
-    return summary
+    cmd = _build_argv("repo", target, severity, format, report_path, ignore_unfixed)
+    return cmd, report_path, target
 
 
-@tool
+@_scan_tool
 def trivy_sbom_scan(
     sbom_path: str,
     severity: str = "HIGH,CRITICAL",
     ignore_unfixed: bool = True,
-    format: str = "json",
+    format: ReportFormat = "json",
     timeout: int = DEFAULT_TIMEOUT,
     output_path: Optional[str] = None,
 ):
@@ -273,25 +446,16 @@ def trivy_sbom_scan(
     """
     target = sbom_path
     report_path = _build_output_path("sbom", output_path)
-    cmd = [
-        "trivy",
+    cmd = _build_argv(
         "sbom",
-        "--input",
         target,
-        "--severity",
         severity,
-        "--format",
         format,
-        "--output",
-        str(report_path),
-    ]
-    if ignore_unfixed:
-        cmd.append("--ignore-unfixed")
-    exit_code = _stream_run(cmd, timeout)
-    summary = _summarize(report_path)
-    summary["exit_code"] = exit_code
-    summary["target"] = target
-    return summary
+        report_path,
+        ignore_unfixed,
+        target_flag="--input",
+    )
+    return cmd, report_path, target
 
 
 @tool
@@ -306,7 +470,7 @@ def trivy_help():
 
 def get_tools():
     """供外部创建 Agent 时统一获取工具集合。"""
-    # 返回所有 @tool 装饰的函数
+    # 返回所有 @tool / @_scan_tool 装饰的函数
     return [
         trivy_image_scan,
         trivy_fs_scan,